@@ -1,24 +1,47 @@
 import asyncio
+import atexit
+import io
 import logging
 import os
+import random
 import sys
+import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Final
-from functools import lru_cache
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Optional, TypeVar, Final
 
-from pyrogram import Client, errors, enums
+from pyrogram import Client, errors, enums, raw
+from pyrogram.file_id import FileId, FileType
 from pyrogram.types import InputMediaDocument, Message
 from rich.console import Console
 from rich.logging import RichHandler
-from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+from rich.progress import DownloadColumn, Progress, SpinnerColumn, TaskID, TextColumn, TimeElapsedColumn
+
+try:
+    import uvloop
+except ImportError:  # Not available on Windows
+    uvloop = None
+
+try:
+    import nest_asyncio
+except ImportError:  # Only needed when run() is called inside a running loop
+    nest_asyncio = None
+
+LOOP_FACTORY = uvloop.new_event_loop if uvloop is not None else None
 
 # Constants
 MAX_CAPTION_LENGTH: Final[int] = 1024
 MAX_RETRY_ATTEMPTS: Final[int] = 3
 RETRY_DELAY: Final[int] = 5
+MAX_RETRY_DELAY: Final[int] = 60
+MAX_MEDIA_GROUP_SIZE: Final[int] = 10
+DEFAULT_UPLOAD_CONCURRENCY: Final[int] = 4
+DEFAULT_RATE_LIMIT_RPS: Final[float] = 1.0
+DEFAULT_UPLOAD_BUFFER_SIZE: Final[int] = 1024 * 1024
+
+T = TypeVar("T")
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Config:
     """Configuration class with immutable attributes."""
     api_id: str
@@ -29,6 +52,8 @@ class Config:
     commit: str = ""
     cherry_pick_commit: str = ""
     tags: str = field(default="")
+    upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY
+    upload_buffer_size: int = DEFAULT_UPLOAD_BUFFER_SIZE
 
     @classmethod
     def from_env(cls) -> 'Config':
@@ -42,10 +67,11 @@ class Config:
         }
         
         config_data = {}
+        getenv = os.environ.get
         
         try:
             for var_name, var_type in required_vars.items():
-                value = os.environ.get(var_name)
+                value = getenv(var_name)
                 if value is None:
                     raise ValueError(f"Missing required environment variable: {var_name}")
                 
@@ -56,54 +82,80 @@ class Config:
             
             # Optional variables
             config_data.update({
-                "commit": os.environ.get("COMMIT", ""),
-                "cherry_pick_commit": os.environ.get("CHERRY_PICK_COMMIT", ""),
-                "tags": os.environ.get("TAGS", "")
+                "commit": getenv("COMMIT", ""),
+                "cherry_pick_commit": getenv("CHERRY_PICK_COMMIT", ""),
+                "tags": getenv("TAGS", "")
             })
             
+            # Optional tuning knobs, mapped to their minimum accepted value
+            tuning_vars = {
+                "UPLOAD_CONCURRENCY": 1,
+                "UPLOAD_BUFFER_SIZE": io.DEFAULT_BUFFER_SIZE,
+            }
+            for var_name, minimum in tuning_vars.items():
+                value = getenv(var_name)
+                if value is None:
+                    continue
+                
+                try:
+                    config_data[var_name.lower()] = max(minimum, int(value))
+                except ValueError:
+                    raise ValueError(f"Invalid value for {var_name}: {value}")
+            
             return cls(**config_data)
         except Exception as e:
             raise ValueError(f"Configuration error: {str(e)}") from e
 
 class MessageBuilder:
-    """Handles message template building with caching."""
-    
-    TEMPLATE: Final[str] = """
-Sing-box {version}
-
-Tags: {tags}
-
-{update_section}
-Cherry-pick:
-{cherry_pick_commit}
-
-[SagerNet/sing-box](https://github.com/SagerNet/sing-box)
-    """.strip()
+    """Builds the release caption once per config."""
 
     def __init__(self, config: Config):
         self.config = config
-
-    @lru_cache(maxsize=1)
-    def build(self) -> str:
-        """Build message with caching for repeated calls."""
-        update_section = f"Update:\n{self.config.commit}\n\n" if self.config.commit else ""
-        
-        msg = self.TEMPLATE.format(
-            version=self.config.version,
-            tags=self.config.tags,
-            update_section=update_section,
-            cherry_pick_commit=self.config.cherry_pick_commit
-        )
         
-        if len(msg) > MAX_CAPTION_LENGTH:
-            msg = self.TEMPLATE.format(
-                version=self.config.version,
-                tags=self.config.tags,
-                update_section="",
-                cherry_pick_commit=self.config.cherry_pick_commit
-            )
+        version = config.version
+        tags = config.tags
+        cherry_pick_commit = config.cherry_pick_commit
+        update_section = f"Update:\n{config.commit}\n\n" if config.commit else ""
+        
+        caption = self._render(version, tags, update_section, cherry_pick_commit)
+        if len(caption) > MAX_CAPTION_LENGTH:
+            caption = self._render(version, tags, "", cherry_pick_commit)
         
-        return msg
+        self._caption = caption
+
+    @staticmethod
+    def _render(version: str, tags: str, update_section: str, cherry_pick_commit: str) -> str:
+        """Render the caption template."""
+        return (
+            f"Sing-box {version}\n"
+            f"\n"
+            f"Tags: {tags}\n"
+            f"\n"
+            f"{update_section}\n"
+            f"Cherry-pick:\n"
+            f"{cherry_pick_commit}\n"
+            f"\n"
+            f"[SagerNet/sing-box](https://github.com/SagerNet/sing-box)"
+        )
+
+    def build(self) -> str:
+        """Return the precomputed caption."""
+        return self._caption
+
+class TokenBucket:
+    """Client-side rate limiter that paces calls to a fixed rate."""
+
+    def __init__(self, rps: float):
+        self.min_interval = 1.0 / rps
+        self.last_call = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until the next call is allowed."""
+        async with self._lock:
+            now = time.monotonic()
+            await asyncio.sleep(max(0.0, self.min_interval - (now - self.last_call)))
+            self.last_call = time.monotonic()
 
 class TelegramUploader:
     """Handles file uploads to Telegram with improved error handling and retries."""
@@ -112,32 +164,85 @@ class TelegramUploader:
         self.config = config
         self.console = Console()
         self.logger = self._setup_logger()
+        self._sem = asyncio.Semaphore(config.upload_concurrency)
+        self._limiter = TokenBucket(rps=DEFAULT_RATE_LIMIT_RPS)
+        self.app: Optional[Client] = None
         
+    async def __aenter__(self) -> 'TelegramUploader':
+        """Start a single Telegram session shared by all uploads."""
+        self.app = Client(
+            "bot",
+            api_id=self.config.api_id,
+            api_hash=self.config.api_hash,
+            bot_token=self.config.bot_token,
+            in_memory=True,
+            max_concurrent_transmissions=self.config.upload_concurrency
+        )
+        await self.app.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        """Stop the shared Telegram session."""
+        if self.app is not None:
+            await self.app.stop()
+            self.app = None
+
+    def _require_app(self) -> Client:
+        """Return the running client or fail if the session was not started."""
+        if self.app is None:
+            raise RuntimeError("TelegramUploader must be used as an async context manager")
+        return self.app
+
     @staticmethod
     def _setup_logger() -> logging.Logger:
         """Setup logger with detailed formatting."""
         logging_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        logging.basicConfig(
-            level=logging.INFO,
-            format=logging_format,
-            handlers=[RichHandler(rich_tracebacks=True, show_time=True)]
-        )
         logger = logging.getLogger("telegram-uploader")
+        if logger.handlers:
+            return logger
+        
+        # Output is captured under CI, so skip Rich's terminal rendering there
+        if os.environ.get("CI"):
+            handler: logging.Handler = logging.StreamHandler()
+        else:
+            handler = RichHandler(rich_tracebacks=True, show_time=True)
+        handler.setFormatter(logging.Formatter(logging_format))
+        
+        logging.basicConfig(level=logging.INFO, handlers=[handler])
+        logger.addHandler(handler)
         logger.setLevel(logging.INFO)
+        logger.propagate = False
         return logger
 
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        """Return True for errors worth retrying: rate limits, server errors, migrations and timeouts."""
+        return isinstance(error, (
+            errors.FloodWait,
+            errors.SlowmodeWait,
+            errors.InternalServerError,
+            errors.ServiceUnavailable,
+            errors.NetworkMigrate,
+            errors.PhoneMigrate,
+            asyncio.TimeoutError,
+            ConnectionError,
+        ))
+
     async def _handle_upload_retry(self, attempt: int, error: Exception) -> None:
-        """Handle upload retry logic."""
-        if attempt < MAX_RETRY_ATTEMPTS:
-            wait_time = RETRY_DELAY * (2 ** attempt)  # Exponential backoff
-            self.logger.warning(f"Attempt {attempt + 1} failed. Retrying in {wait_time} seconds... Error: {error}")
-            await asyncio.sleep(wait_time)
+        """Wait before the next attempt: the server-requested delay for rate limits, backoff otherwise."""
+        if isinstance(error, (errors.FloodWait, errors.SlowmodeWait)):
+            wait_time = error.value + random.uniform(0, 1)
+            self.logger.warning(f"Rate limit hit, waiting {wait_time:.1f} seconds")
         else:
-            raise Exception(f"Max retry attempts ({MAX_RETRY_ATTEMPTS}) reached. Last error: {error}")
+            wait_time = min(RETRY_DELAY * (2 ** attempt), MAX_RETRY_DELAY)  # Exponential backoff
+            wait_time = random.uniform(wait_time * 0.5, wait_time * 1.5)  # Jitter to spread concurrent retries
+            self.logger.warning(f"Attempt {attempt + 1} failed. Retrying in {wait_time:.1f} seconds... Error: {error}")
+        await asyncio.sleep(wait_time)
 
     async def _pin_message(self, app: Client, message: Message) -> None:
         """Pin message with error handling."""
         try:
+            await self._limiter.acquire()
             await app.pin_chat_message(
                 chat_id=self.config.chat_id,
                 message_id=message.id,
@@ -147,77 +252,277 @@ class TelegramUploader:
             self.logger.error(f"Failed to pin message: {e}")
             # Don't raise the error as this is not critical
 
-    async def upload_files(self, files: List[Path]) -> None:
-        """Upload files with improved error handling and progress tracking."""
-        self.logger.info(f"Starting upload process for {len(files)} files")
+    def _open_file(self, file: Path) -> BinaryIO:
+        """Open a file for streaming upload with the configured read buffer."""
+        return io.BufferedReader(io.FileIO(file, "rb"), buffer_size=self.config.upload_buffer_size)
+
+    async def _with_retries(self, call: Callable[[], Awaitable[T]], what: str) -> T:
+        """Run call under the concurrency limit, retrying transient errors with backoff."""
+        async with self._sem:
+            for attempt in range(MAX_RETRY_ATTEMPTS):
+                try:
+                    return await call()
+                    
+                except Exception as e:
+                    if not self._is_transient(e):
+                        raise
+                    if attempt == MAX_RETRY_ATTEMPTS - 1:
+                        raise Exception(
+                            f"Max retry attempts ({MAX_RETRY_ATTEMPTS}) reached for {what}. Last error: {e}"
+                        ) from e
+                    await self._handle_upload_retry(attempt, e)
+
+    async def _preupload(self, app: Client, file: Path, size: int, progress: Progress, task_id: TaskID) -> str:
+        """Upload a file once and return its file_id, so media group retries never resend the bytes."""
+        reported = 0
+        input_file = None
         
-        async with Client(
-            "bot",
-            api_id=self.config.api_id,
-            api_hash=self.config.api_hash,
-            bot_token=self.config.bot_token,
-            in_memory=True
-        ) as app:
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                TimeElapsedColumn(),
-                console=self.console
-            ) as progress:
-                upload_task = progress.add_task("Preparing files...", total=len(files))
-                
-                media = [
-                    InputMediaDocument(
-                        media=str(file),
-                        caption="" if file != files[-1] else MessageBuilder(self.config).build(),
-                        parse_mode=enums.ParseMode.MARKDOWN
-                    )
-                    for file in files
-                ]
-                
-                for attempt in range(MAX_RETRY_ATTEMPTS):
-                    try:
-                        progress.update(upload_task, description=f"Uploading files (Attempt {attempt + 1})...")
-                        sent_messages = await app.send_media_group(
-                            chat_id=self.config.chat_id,
-                            media=media
+        async def report(current: int, total: int) -> None:
+            nonlocal reported
+            if current > reported:
+                progress.update(task_id, advance=current - reported)
+                reported = current
+        
+        async def upload() -> str:
+            nonlocal input_file
+            if input_file is None:
+                # Opened per attempt so only in-flight uploads hold a read buffer
+                with self._open_file(file) as handle:
+                    input_file = await app.save_file(handle, progress=report)
+                if input_file is None:
+                    # save_file logs and swallows transfer errors instead of raising them
+                    raise ConnectionError(f"Transfer of {file.name} did not complete")
+            
+            while True:
+                await self._limiter.acquire()
+                try:
+                    uploaded = await app.invoke(
+                        raw.functions.messages.UploadMedia(
+                            peer=await app.resolve_peer(self.config.chat_id),
+                            media=raw.types.InputMediaUploadedDocument(
+                                mime_type=app.guess_mime_type(file.name) or "application/zip",
+                                file=input_file,
+                                attributes=[raw.types.DocumentAttributeFilename(file_name=file.name)]
+                            )
                         )
-                        
-                        if sent_messages:
-                            await self._pin_message(app, sent_messages[-1])
-                        
-                        progress.update(upload_task, advance=len(files))
-                        self.logger.info("Upload completed successfully")
-                        break
-                        
-                    except errors.FloodWait as e:
-                        self.logger.warning(f"Rate limit hit, waiting {e.value} seconds")
-                        await asyncio.sleep(e.value)
-                        continue
-                        
-                    except Exception as e:
-                        await self._handle_upload_retry(attempt, e)
+                    )
+                except errors.FilePartMissing as e:
+                    # Re-send only the dropped part, as Pyrogram's send_document does
+                    with self._open_file(file) as handle:
+                        await app.save_file(handle, file_id=input_file.id, file_part=e.value)
+                else:
+                    break
+            
+            document = uploaded.document
+            return FileId(
+                file_type=FileType.DOCUMENT,
+                dc_id=document.dc_id,
+                media_id=document.id,
+                access_hash=document.access_hash,
+                file_reference=document.file_reference
+            ).encode()
+        
+        file_id = await self._with_retries(upload, file.name)
+        progress.update(task_id, advance=size - reported)
+        return file_id
 
-async def main() -> None:
-    """Main function with improved error handling."""
-    try:
-        config = Config.from_env()
+    @staticmethod
+    def _split_groups(media: List[InputMediaDocument]) -> List[List[InputMediaDocument]]:
+        """Split media into as few groups as possible, balanced so none falls below two items."""
+        count = -(-len(media) // MAX_MEDIA_GROUP_SIZE)
+        size, extra = divmod(len(media), count)
+        groups = []
+        start = 0
+        for i in range(count):
+            end = start + size + (1 if i < extra else 0)
+            groups.append(media[start:end])
+            start = end
+        return groups
+
+    async def _send_group(self, app: Client, media: List[InputMediaDocument]) -> List[Message]:
+        """Send a single media group, retrying only this group on failure."""
+        async def send() -> List[Message]:
+            await self._limiter.acquire()
+            if len(media) == 1:
+                # Media groups need at least two items
+                item = media[0]
+                return [await app.send_document(
+                    chat_id=self.config.chat_id,
+                    document=item.media,
+                    caption=item.caption,
+                    parse_mode=item.parse_mode
+                )]
+            return await app.send_media_group(
+                chat_id=self.config.chat_id,
+                media=media
+            )
         
-        files = [Path(f) for f in sys.argv[1:]]
+        return await self._with_retries(send, "media group")
+
+    async def upload_files(self, files: List[Path], sizes: Optional[Dict[Path, int]] = None) -> None:
+        """Upload files in concurrent media groups with per-group retries."""
         if not files:
             raise ValueError("No files specified for upload")
         
-        # Validate all files before starting upload
-        invalid_files = [f for f in files if not f.exists()]
-        if invalid_files:
-            raise FileNotFoundError(f"Files not found: {', '.join(str(f) for f in invalid_files)}")
+        self.logger.info(f"Starting upload process for {len(files)} files")
+        
+        if sizes is None:
+            sizes = stat_files(files)
         
-        uploader = TelegramUploader(config)
-        await uploader.upload_files(files)
+        app = self._require_app()
         
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            DownloadColumn(),
+            TimeElapsedColumn(),
+            console=self.console,
+            refresh_per_second=4
+        ) as progress:
+            upload_task = progress.add_task("Uploading files...", total=sum(sizes[f] for f in files))
+            
+            # Upload every file once; media groups then only reference the cached file_ids
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    # Start the largest files first so they don't end up as the tail
+                    uploads = {
+                        file: tg.create_task(self._preupload(app, file, sizes[file], progress, upload_task))
+                        for file in sorted(files, key=lambda f: -sizes[f])
+                    }
+            except ExceptionGroup as eg:
+                # TaskGroup cancels the remaining uploads on the first failure
+                raise Exception(f"File upload aborted: {eg.exceptions[0]}") from eg
+            # The album keeps the caller's file order
+            file_ids = [uploads[file].result() for file in files]
+            
+            caption = MessageBuilder(self.config).build()
+            last_idx = len(files) - 1
+            media = [
+                InputMediaDocument(
+                    media=file_id,
+                    caption=caption if i == last_idx else "",
+                    parse_mode=enums.ParseMode.MARKDOWN
+                )
+                for i, file_id in enumerate(file_ids)
+            ]
+            groups = self._split_groups(media)
+            
+            progress.update(upload_task, description=f"Sending {len(groups)} media group(s)...")
+            *head, tail = groups
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    for group in head:
+                        tg.create_task(self._send_group(app, group))
+            except ExceptionGroup as eg:
+                raise Exception(f"Media group send aborted: {eg.exceptions[0]}") from eg
+            
+            # The captioned group goes last so the pinned caption follows every file
+            sent_messages = await self._send_group(app, tail)
+            if sent_messages:
+                await self._pin_message(app, sent_messages[-1])
+            
+            self.logger.info("Upload completed successfully")
+
+def stat_files(files: List[Path]) -> Dict[Path, int]:
+    """Return the size of every file, scanning each directory only once."""
+    by_parent: Dict[Path, List[Path]] = {}
+    for file in files:
+        by_parent.setdefault(file.parent, []).append(file)
+    
+    sizes: Dict[Path, int] = {}
+    missing: List[Path] = []
+    for parent, children in by_parent.items():
+        wanted = {file.name for file in children}
+        try:
+            with os.scandir(parent) as entries:
+                found = {entry.name: entry.stat().st_size for entry in entries if entry.name in wanted}
+        except FileNotFoundError:
+            found = {}
+        
+        for file in children:
+            if file.name in found:
+                sizes[file] = found[file.name]
+            else:
+                missing.append(file)
+    
+    if missing:
+        raise FileNotFoundError(f"Files not found: {', '.join(str(f) for f in missing)}")
+    
+    return sizes
+
+async def _run(files: List[Path], uploader: Optional[TelegramUploader] = None) -> None:
+    """Validate files and upload them, opening a session from the environment unless one is given."""
+    config = Config.from_env() if uploader is None else uploader.config
+    
+    if not files:
+        raise ValueError("No files specified for upload")
+    
+    # Validate all files before starting upload
+    sizes = stat_files(files)
+    
+    if uploader is not None:
+        await uploader.upload_files(files, sizes)
+        return
+    
+    async with TelegramUploader(config) as uploader:
+        await uploader.upload_files(files, sizes)
+
+_runner: Optional[asyncio.Runner] = None
+_uploader: Optional[TelegramUploader] = None
+
+def run(files: List[Path]) -> None:
+    """Upload files from synchronous code.
+
+    The event loop and Telegram session stay open between calls; call close() to release them.
+    """
+    global _runner, _uploader
+    
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    
+    if running is not None:
+        # Jupyter and some test runners already drive a loop; nest_asyncio can't patch uvloop
+        if nest_asyncio is None or (uvloop is not None and isinstance(running, uvloop.Loop)):
+            raise RuntimeError("run() called from a running event loop; await _run() instead")
+        nest_asyncio.apply(running)
+        running.run_until_complete(_run(files))
+        return
+    
+    if _runner is None:
+        _runner = asyncio.Runner(loop_factory=LOOP_FACTORY)
+        atexit.register(close)
+    if _uploader is None:
+        uploader = TelegramUploader(Config.from_env())
+        _runner.run(uploader.__aenter__())
+        _uploader = uploader
+    _runner.run(_run(files, _uploader))
+
+def close() -> None:
+    """Stop the Telegram session and event loop kept open by run()."""
+    global _runner, _uploader
+    
+    if _runner is None:
+        return
+    
+    try:
+        if _uploader is not None:
+            _runner.run(_uploader.__aexit__(None, None, None))
+    finally:
+        _uploader = None
+        _runner.close()
+        _runner = None
+        atexit.unregister(close)
+
+async def main() -> None:
+    """Main function with improved error handling."""
+    try:
+        await _run([Path(f) for f in sys.argv[1:]])
     except Exception as e:
         logging.error(f"Fatal error: {str(e)}", exc_info=True)
         sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    with asyncio.Runner(loop_factory=LOOP_FACTORY) as runner:
+        runner.run(main())
\ No newline at end of file